@@ -1,5 +1,5 @@
+import io
 import os
-import uuid
 import json
 import re
 import logging
@@ -7,12 +7,26 @@ import asyncio
 import discord
 import random
 import time
+import heapq
+import hashlib
+import itertools
 from discord.ext import commands
 from discord import app_commands
 from pybloom_live import ScalableBloomFilter
-from collections import defaultdict
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:  # orjson lacks wheels on some platforms; the stdlib is slower but works
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+    json_loads = json.loads
 
 # --- Configure logging ---
 logging.basicConfig(
@@ -22,7 +36,8 @@ logging.basicConfig(
 )
 
 # --- Default Messages ---
-DRAMATIC_MESSAGES = [
+# A tuple, so every guild still on the defaults can share it instead of holding a copy
+DRAMATIC_MESSAGES = (
     "🌟 The ancient scrolls have recognized {user} as a true {role}!",
     "⚔️ Through trials of valor, {user} ascends to the ranks of {role}!",
     "✨ The mystical gates of {role} part before {user}'s destined arrival!",
@@ -33,14 +48,132 @@ DRAMATIC_MESSAGES = [
     "🎭 The {role} welcomes their newest member, {user}!",
     "💫 {user} has proven worthy of the {role}'s ancient power!",
     "🔥 The flames of destiny mark {user} as a true {role}!"
-]
+)
+
+# --- Helpers ---
+# Hex UUID with optional dashes; matched in C so bad input never raises
+UUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}\Z')
+COMMAND_NAME_PATTERN = re.compile(r'[a-z0-9-]{1,32}\Z')
+LINE_PATTERN = re.compile(r'[^\n]+')
+
+def iter_keys(text: str) -> Iterator[str]:
+    """
+    Yield the non-blank, stripped lines of pasted or uploaded key text.
+    Lines are found lazily and split on '\n' only, so a 5MB upload is never copied into a list.
+    """
+    lines = (match.group().strip() for match in LINE_PATTERN.finditer(text))
+    return (key for key in lines if key)
+
+def iter_chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def hash_key(key_bytes: bytes, salt: bytes) -> bytes:
+    """Return the salted 16-byte digest a raw UUID key is stored as."""
+    return hashlib.blake2b(key_bytes, digest_size=16, salt=salt).digest()
+
+def read_snapshot() -> Tuple[Dict[str, dict], bool]:
+    """
+    Reads every guild's saved config, turning each key list into a set of key digests.
+    Returns the configs by guild id and whether a legacy single-file realms.json was read.
+    Runs in a worker thread so a large snapshot never stalls startup on the event loop.
+    """
+    realms = {}
+    legacy = False
+    try:
+        with open('realms.json', 'rb') as f:
+            realms.update(json_loads(f.read()))
+        legacy = True
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        logging.error("Could not decode realms.json. File might be corrupt.")
+
+    # Per-guild files are newer than anything left in realms.json
+    for entry in os.scandir('realms'):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, 'rb') as f:
+                realms[entry.name[:-5]] = json_loads(f.read())
+        except json.JSONDecodeError:
+            logging.error(f"Could not decode {entry.path}. File might be corrupt.")
+
+    for data in realms.values():
+        keys = data.get('keys', [])
+        if isinstance(keys, str):
+            # One hex string of back-to-back 16-byte keys
+            raw = bytes.fromhex(keys)
+            keys = {raw[i:i + 16] for i in range(0, len(raw), 16)}
+        else:
+            # Older files list each key as hex or a dashed UUID string. bytes.fromhex is an
+            # order of magnitude cheaper than building a uuid.UUID per key.
+            keys = {bytes.fromhex(key.replace('-', '')) for key in keys}
+
+        if 'salt' in data:
+            data['salt'] = bytes.fromhex(data['salt'])
+        else:
+            # Older files hold the keys themselves; from now on only their digests are kept
+            salt = data['salt'] = os.urandom(16)
+            keys = {hash_key(key, salt) for key in keys}
+            data['migrated'] = True
+        data['keys'] = keys
+    return realms, legacy
+
+def write_atomic(path: str, data: bytes):
+    """Writes data to path via temp file + fsync + rename, so a crash never leaves it torn."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_snapshot(realms: List[Tuple[str, str, bytes]], filters: List[Tuple[str, bytes]],
+                   removed: List[str], drop_legacy: bool) -> List[str]:
+    """
+    Writes pre-serialized bloom filters and the configs of changed guilds, and deletes the
+    files of guilds that are gone. Runs in a worker thread; filters go first so every key
+    in a guild's config file is in its filter. A guild whose filter could not be written
+    keeps its old config file too. Returns the filter paths that failed.
+    """
+    for path in removed:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    failed = []
+    for path, data in filters:
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as bf:
+                bf.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error(f"Could not save bloom filter {path}: {e}")
+            failed.append(path)
+
+    for path, filter_path, data in realms:
+        if filter_path not in failed:
+            write_atomic(path, data)
+
+    # Every guild read from realms.json now has its own file. It still holds the raw keys,
+    # so keep it aside rather than deleting the last copy of them.
+    if drop_legacy and not failed:
+        os.replace('realms.json', 'realms.json.bak')
+        logging.info("Migrated realms.json to realms/; the old file is kept as realms.json.bak.")
+    return failed
 
 # --- Guild Configuration Class ---
 class GuildConfig:
     """Stores all configuration and data for a single guild."""
     __slots__ = ('role_id', 'command', 'key_filter', 'key_store', 
                  'success_msgs', 'stats', 'custom_cooldown', 
-                 'filter_path', 'announcement_channel_id')
+                 'filter_path', 'filter_dirty', 'config_path', 'dirty',
+                 'announcement_channel_id', 'synced_command', 'salt')
     
     def __init__(self, role_id: int, guild_id: int):
         self.role_id = role_id
@@ -48,8 +181,12 @@ class GuildConfig:
         self.filter_path = f'bloom_filters/filter_{guild_id}.bloom'
         self.announcement_channel_id: Optional[int] = None
         self.key_filter = ScalableBloomFilter(mode=ScalableBloomFilter.LARGE_SET_GROWTH)
-        self.key_store = set()
-        self.success_msgs = DRAMATIC_MESSAGES.copy()
+        self.filter_dirty = True  # Whether key_filter differs from the copy on disk
+        self.config_path = f'realms/{guild_id}.json'
+        self.dirty = True  # Whether this config differs from the copy on disk
+        self.key_store = set()  # Salted digests of the keys, never the keys themselves
+        self.salt = os.urandom(16)
+        self.success_msgs = DRAMATIC_MESSAGES
         self.stats = {
             'keys_added': 0,
             'keys_removed': 0,
@@ -59,43 +196,115 @@ class GuildConfig:
             'total_keys': 0
         }
         self.custom_cooldown = 300  # Default 5 minutes
+        self.synced_command: Optional[str] = None  # Claim command name Discord last received
+
+    def to_dict(self) -> dict:
+        """Return the JSON-serializable form stored in this guild's config file."""
+        return {
+            'role_id': self.role_id,
+            'command': self.command,
+            # Every key is 16 bytes, so one joined hex string needs no per-key strings or framing
+            'keys': b''.join(self.key_store).hex(),
+            'salt': self.salt.hex(),
+            'success_msgs': self.success_msgs,
+            'custom_cooldown': self.custom_cooldown,
+            'announcement_channel_id': self.announcement_channel_id,
+            'stats': self.stats,
+            'synced_command': self.synced_command,
+            # The filter only grows, so its count tells a stale filter file from the saved one
+            'filter_count': len(self.key_filter)
+        }
 
-    def add_key(self, key: str) -> bool:
-        """Add a key to the key store and Bloom filter."""
-        try:
-            key_normalized = str(uuid.UUID(key)).lower()
-            if key_normalized not in self.key_store:
-                self.key_store.add(key_normalized)
-                self.key_filter.add(key_normalized)
-                self.stats['keys_added'] += 1
-                self.stats['total_keys'] = len(self.key_store)
-                return True
-            return False
-        except ValueError:
-            return False
+    def normalize_key(self, key: str) -> Optional[bytes]:
+        """Return the salted digest a UUID key is stored as, or None if it is malformed."""
+        if not UUID_PATTERN.match(key):
+            return None
+        return hash_key(bytes.fromhex(key.replace('-', '')), self.salt)
 
-    def remove_key(self, key: str) -> bool:
-        """Remove a key from the key store."""
-        try:
-            key_normalized = str(uuid.UUID(key)).lower()
-            if key_normalized in self.key_store:
-                self.key_store.remove(key_normalized)
-                self.stats['keys_removed'] += 1
-                self.stats['total_keys'] = len(self.key_store)
-                return True
+    def _insert(self, key_bytes: bytes) -> bool:
+        if key_bytes in self.key_store:
             return False
-        except ValueError:
+        self.key_store.add(key_bytes)
+        self.key_filter.add(key_bytes)
+        self.filter_dirty = True
+        return True
+
+    def add_keys(self, keys: Iterable[str]) -> Tuple[List[bytes], int]:
+        """Add many keys in one pass; returns (normalized keys added, invalid_or_duplicate)."""
+        normalized = list(map(self.normalize_key, keys))
+        added = self.insert_keys(normalized)
+        return added, len(normalized) - len(added)
+
+    def insert_keys(self, normalized: Iterable[Optional[bytes]]) -> List[bytes]:
+        """Add already normalized keys in one pass; returns the ones that were new."""
+        new_keys = set(normalized) - self.key_store
+        new_keys.discard(None)
+        self.key_store |= new_keys
+        for key_bytes in new_keys:
+            self.key_filter.add(key_bytes)
+        # A paste of nothing but duplicates leaves the guild clean, so the next save skips it
+        if new_keys:
+            self.filter_dirty = True
+            self.stats['keys_added'] += len(new_keys)
+            self.stats['total_keys'] = len(self.key_store)
+            self.dirty = True
+        return list(new_keys)
+
+    def restore_key(self, key_bytes: bytes) -> bool:
+        """Put back an already normalized key, e.g. after a failed role grant."""
+        if not self._insert(key_bytes):
             return False
+        self.stats['keys_added'] += 1
+        self.stats['total_keys'] = len(self.key_store)
+        self.dirty = True
+        return True
 
-    def verify_key(self, key: str) -> bool:
-        """Verify if a key is valid using the Bloom filter and then the key store."""
-        try:
-            key_normalized = str(uuid.UUID(key)).lower()
-            if key_normalized not in self.key_filter:
-                return False
-            return key_normalized in self.key_store
-        except ValueError:
+    def remove_keys(self, keys: Iterable[str]) -> Tuple[List[bytes], int]:
+        """Remove many keys in one pass; returns (normalized keys removed, not_found)."""
+        normalized = list(map(self.normalize_key, keys))
+        removed = self.discard_keys(normalized)
+        return removed, len(normalized) - len(removed)
+
+    def discard_keys(self, normalized: Iterable[Optional[bytes]]) -> List[bytes]:
+        """Remove already normalized keys in one pass; returns the ones that were present."""
+        hits = self.key_store.intersection(normalized)
+        if hits:
+            self.key_store -= hits
+            self.stats['keys_removed'] += len(hits)
+            self.stats['total_keys'] = len(self.key_store)
+            self.dirty = True
+        return list(hits)
+
+    def consume_key(self, key_bytes: bytes) -> bool:
+        """Remove an already normalized key if it is valid, without re-parsing it."""
+        if key_bytes not in self.key_filter or key_bytes not in self.key_store:
             return False
+        self.key_store.remove(key_bytes)
+        self.stats['keys_removed'] += 1
+        self.stats['total_keys'] = len(self.key_store)
+        self.dirty = True
+        return True
+
+    def clear_keys(self) -> int:
+        """Remove every key and reset the Bloom filter; returns how many were removed."""
+        key_count = len(self.key_store)
+        self.key_store.clear()
+        self.rebuild_filter()
+        self.stats['keys_removed'] += key_count
+        self.stats['total_keys'] = 0
+        self.dirty = True
+        return key_count
+
+    def rebuild_filter(self):
+        """Rebuild the Bloom filter from the key store, sized so all keys fit in one stage."""
+        key_filter = ScalableBloomFilter(
+            initial_capacity=max(len(self.key_store), 100),
+            mode=ScalableBloomFilter.LARGE_SET_GROWTH
+        )
+        for key in self.key_store:
+            key_filter.add(key)
+        self.key_filter = key_filter
+        self.filter_dirty = True
 
 # --- Modals ---
 class ArcaneGatewayModal(discord.ui.Modal, title="🔮 Mystical Gateway"):
@@ -173,7 +382,7 @@ class SetupModal(discord.ui.Modal, title="🏰 Realm Setup"):
             
             # --- Command Name Sanitization ---
             command_name = self.command_name_input.value.strip().lower()
-            if not re.match(r'^[a-z0-9-]{1,32}$', command_name):
+            if not COMMAND_NAME_PATTERN.match(command_name):
                 await interaction.followup.send("❌ Invalid command name. Please use only lowercase letters, numbers, and hyphens.", ephemeral=True)
                 return
             
@@ -219,16 +428,12 @@ class SetupModal(discord.ui.Modal, title="🏰 Realm Setup"):
                 cfg.announcement_channel_id = announcement_channel.id
             else:
                 cfg.announcement_channel_id = None
+            cfg.dirty = True
 
-            added, invalid = 0, 0
+            added, invalid = [], 0
             initial_keys = self.initial_keys_input.value.strip()
             if initial_keys:
-                keys = [k.strip() for k in initial_keys.split('\n') if k.strip()]
-                for key in keys:
-                    if cfg.add_key(key):
-                        added += 1
-                    else:
-                        invalid += 1
+                added, invalid = cfg.add_keys(iter_keys(initial_keys))
             
             try:
                 await bot.register_guild_commands(interaction.guild, command_name)
@@ -237,7 +442,7 @@ class SetupModal(discord.ui.Modal, title="🏰 Realm Setup"):
                 await interaction.followup.send("⚠️ Failed to create or update the slash command.", ephemeral=True)
                 return
 
-            await bot.save_config()
+            bot.mark_dirty()
 
             response = [
                 f"✨ Realm configuration updated for {role.mention}!",
@@ -246,7 +451,7 @@ class SetupModal(discord.ui.Modal, title="🏰 Realm Setup"):
             if announcement_channel:
                 response.append(f"📢 Success messages will be posted in {announcement_channel.mention}.")
             if initial_keys:
-                response.append(f"\n📦 Added {added} new keys ({invalid} were invalid or duplicates).")
+                response.append(f"\n📦 Added {len(added)} new keys ({invalid} were invalid or duplicates).")
             
             await interaction.followup.send("\n".join(response), ephemeral=True)
         except Exception as e:
@@ -271,17 +476,14 @@ class BulkKeyModal(discord.ui.Modal, title="📚 Bulk Key Addition"):
             await interaction.followup.send("❌ Run `/setup` first!", ephemeral=True)
             return
             
-        keys = [k.strip() for k in self.keys_input.value.split('\n') if k.strip()]
+        keys = iter_keys(self.keys_input.value)
         
-        async with bot.locks[guild_id]:
-            added, invalid = 0, 0
-            for key in keys:
-                if cfg.add_key(key):
-                    added += 1
-                else:
-                    invalid += 1
+        async with bot.get_lock(guild_id):
+            added, invalid = cfg.add_keys(keys)
+            if added:
+                bot.journal_keys('add', guild_id, added)
         
-        await interaction.followup.send(f"📦 Added {added} new keys. ({invalid} were invalid or duplicates).", ephemeral=True)
+        await interaction.followup.send(f"📦 Added {len(added)} new keys. ({invalid} were invalid or duplicates).", ephemeral=True)
 
 class RemoveKeysModal(discord.ui.Modal, title="🗑️ Remove Keys"):
     keys_input = discord.ui.TextInput(
@@ -301,17 +503,14 @@ class RemoveKeysModal(discord.ui.Modal, title="🗑️ Remove Keys"):
             await interaction.followup.send("❌ Run `/setup` first!", ephemeral=True)
             return
             
-        keys = [k.strip() for k in self.keys_input.value.split('\n') if k.strip()]
+        keys = iter_keys(self.keys_input.value)
         
-        async with bot.locks[guild_id]:
-            removed, not_found = 0, 0
-            for key in keys:
-                if cfg.remove_key(key):
-                    removed += 1
-                else:
-                    not_found += 1
+        async with bot.get_lock(guild_id):
+            removed, not_found = cfg.remove_keys(keys)
+            if removed:
+                bot.journal_keys('remove', guild_id, removed)
         
-        await interaction.followup.send(f"🗑️ Removed {removed} keys. ({not_found} were not found).", ephemeral=True)
+        await interaction.followup.send(f"🗑️ Removed {len(removed)} keys. ({not_found} were not found).", ephemeral=True)
 
 class CustomizeModal(discord.ui.Modal, title="📜 Customize Success Messages"):
     messages_input = discord.ui.TextInput(
@@ -349,6 +548,8 @@ class CustomizeModal(discord.ui.Modal, title="📜 Customize Success Messages"):
             return
         
         cfg.success_msgs = messages
+        cfg.dirty = True
+        bot.mark_dirty()
         await interaction.followup.send(f"✨ Success messages updated! There are now {len(messages)} unique messages.", ephemeral=True)
 
 # --- Admin Cog & Commands ---
@@ -414,28 +615,27 @@ class AdminCog(commands.Cog):
         
         try:
             content = await file.read()
-            keys = [k.strip() for k in content.decode('utf-8').split('\n') if k.strip()]
+            keys = iter_keys(content.decode('utf-8'))
         except Exception as e:
             logging.error(f"File read error: {e}")
             await interaction.followup.send("💥 Failed to read the file content.", ephemeral=True)
             return
 
-        async with bot.locks[guild_id]:
+        async with bot.get_lock(guild_id):
             if overwrite:
-                key_count = len(cfg.key_store)
-                cfg.key_store.clear()
-                cfg.key_filter = ScalableBloomFilter(mode=ScalableBloomFilter.LARGE_SET_GROWTH)
-                cfg.stats['keys_removed'] += key_count
+                key_count = cfg.clear_keys()
+                bot.journal_keys('clear', guild_id)
                 logging.info(f"Cleared {key_count} keys for overwrite in guild {guild_id}.")
 
+            # Merge in slices so a huge file never blocks the event loop for long
             added, invalid = 0, 0
-            for key in keys:
-                if cfg.add_key(key):
-                    added += 1
-                else:
-                    invalid += 1
-        
-        await bot.save_config()
+            for chunk in iter_chunks(keys, 5000):
+                chunk_added, chunk_invalid = cfg.add_keys(chunk)
+                if chunk_added:
+                    bot.journal_keys('add', guild_id, chunk_added)
+                added += len(chunk_added)
+                invalid += chunk_invalid
+                await asyncio.sleep(0)
 
         await interaction.followup.send(
             f"📦 Load complete. Added {added} new keys. "
@@ -463,14 +663,10 @@ class AdminCog(commands.Cog):
 
         await interaction.response.defer(ephemeral=True)
         
-        async with self.bot.locks[interaction.guild_id]:
-            key_count = len(cfg.key_store)
-            cfg.key_store.clear()
-            cfg.key_filter = ScalableBloomFilter(mode=ScalableBloomFilter.LARGE_SET_GROWTH)
-            cfg.stats['keys_removed'] += key_count
-            cfg.stats['total_keys'] = 0
+        async with self.bot.get_lock(interaction.guild_id):
+            key_count = cfg.clear_keys()
+            self.bot.journal_keys('clear', interaction.guild_id)
         
-        await self.bot.save_config()
         await interaction.followup.send(f"🗑️ Cleared all {key_count} keys!", ephemeral=True)
 
     @app_commands.command(name="stats", description="📊 View statistics for this realm.")
@@ -522,18 +718,54 @@ class AdminCog(commands.Cog):
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # --- Dynamic Cooldown Logic ---
-async def dynamic_cooldown(interaction: discord.Interaction) -> Optional[app_commands.Cooldown]:
-    """Applies a dynamic cooldown unless the user is an admin."""
+class CustomCooldown:
+    """Tracks claim cooldowns in one flat dict keyed by (guild_id, user_id)."""
+    __slots__ = ('_expiry', '_heap')
+
+    def __init__(self):
+        self._expiry: Dict[Tuple[int, int], float] = {}
+        self._heap: List[Tuple[float, int, int]] = []
+
+    def get_retry_after(self, guild_id: int, user_id: int, now: float) -> float:
+        expiry = self._expiry.get((guild_id, user_id))
+        if expiry is None or expiry <= now:
+            return 0.0
+        return expiry - now
+
+    def trigger(self, guild_id: int, user_id: int, per: float, now: float):
+        expiry = now + per
+        self._expiry[(guild_id, user_id)] = expiry
+        heapq.heappush(self._heap, (expiry, guild_id, user_id))
+
+    def cleanup_expired(self, now: float):
+        """Drop expired entries; only touches entries that have actually expired."""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expiry, guild_id, user_id = heapq.heappop(heap)
+            key = (guild_id, user_id)
+            if self._expiry.get(key) == expiry:
+                del self._expiry[key]
+
+async def dynamic_cooldown(interaction: discord.Interaction) -> bool:
+    """Applies the guild's claim cooldown unless the user is an admin."""
     if interaction.user.guild_permissions.administrator:
-        return None # No cooldown for admins
+        return True # No cooldown for admins
     
     bot = interaction.client
     cfg = bot.config.get(interaction.guild_id)
-    if cfg:
-        return app_commands.Cooldown(1, float(cfg.custom_cooldown))
     # If there is no config for the guild, do not apply a cooldown.
     # This allows the command to proceed to the logic that tells the user to run /setup.
-    return None
+    if not cfg or cfg.custom_cooldown <= 0:
+        return True
+
+    now = time.monotonic()
+    cooldowns = bot.cooldowns
+    cooldowns.cleanup_expired(now)
+    retry_after = cooldowns.get_retry_after(interaction.guild_id, interaction.user.id, now)
+    if retry_after:
+        raise app_commands.CommandOnCooldown(app_commands.Cooldown(1, float(cfg.custom_cooldown)), retry_after)
+    cooldowns.trigger(interaction.guild_id, interaction.user.id, float(cfg.custom_cooldown), now)
+    return True
 
 # --- Dynamic Claim Cog ---
 class ClaimCog(commands.Cog):
@@ -584,10 +816,18 @@ class RealmKeeper(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.members = True
-        super().__init__(command_prefix='!', intents=intents)
+        # Everything runs through slash commands; no message events or message cache needed
+        intents.messages = False
+        super().__init__(command_prefix='!', intents=intents, max_messages=None)
         self.config = dict()
-        self.locks = defaultdict(asyncio.Lock)
+        self.locks: Dict[object, asyncio.Lock] = {}
+        self.cooldowns = CustomCooldown()
         self.save_task = None
+        self._save_event = asyncio.Event()
+        self.journal = None
+        self.removed_paths = set()  # Config files of departed guilds, deleted on the next save
+        self._legacy_snapshot = False  # Whether realms.json still holds configs to migrate
+        self._commands_synced = False
         
     async def setup_hook(self):
         try:
@@ -600,14 +840,23 @@ class RealmKeeper(commands.Bot):
 
     async def on_ready(self):
         try:
-            for guild in self.guilds:
-                if guild.id in self.config:
-                    cfg = self.config[guild.id]
-                    if cfg.command:
-                        await self.register_guild_commands(guild, cfg.command)
-
-            await self.tree.sync()
-            logging.info("✅ Global and guild commands synced.")
+            # on_ready fires again after every full reconnect; commands only need syncing once
+            if not self._commands_synced:
+                stale_guilds = []
+                for guild in self.guilds:
+                    if guild.id in self.config:
+                        cfg = self.config[guild.id]
+                        if cfg.command:
+                            await self.register_guild_commands(guild, cfg.command, sync=False)
+                            # Discord keeps guild commands across restarts; only push changed ones
+                            if cfg.synced_command != cfg.command:
+                                stale_guilds.append(guild)
+
+                await self.tree.sync()
+                failed = await self.sync_guild_commands(stale_guilds)
+                # Anything that failed is retried on the next on_ready
+                self._commands_synced = not failed
+                logging.info(f"✅ Global commands and {len(stale_guilds) - failed} guild command trees synced.")
 
             activity = discord.Activity(type=discord.ActivityType.watching, name="for ✨ mystical keys")
             await self.change_presence(activity=activity)
@@ -617,85 +866,259 @@ class RealmKeeper(commands.Bot):
 
     async def on_guild_remove(self, guild: discord.Guild):
         if guild.id in self.config:
-            async with self.locks['global']:
-                del self.config[guild.id]
-                await self.save_config()
+            async with self.get_lock('global'):
+                cfg = self.config.pop(guild.id)
+                self.removed_paths.add(cfg.config_path)
+            self.locks.pop(guild.id, None)
+            self.mark_dirty()
             logging.info(f"Removed configuration for guild {guild.id} as I was removed.")
 
+    async def close(self):
+        if self.save_task:
+            self.save_task.cancel()
+        if self._save_event.is_set():
+            await self.flush_config()
+        if self.journal:
+            self.journal.close()
+        await super().close()
+
+    def get_lock(self, key) -> asyncio.Lock:
+        """Return the lock for a guild id (or 'global'), creating it only when first needed."""
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    def journal_keys(self, op: str, guild_id: int, keys: Iterable[bytes] = ()):
+        """
+        Appends a single key mutation to realms.journal instead of rewriting the guild's config.
+        The journal is replayed on load and folded into the config files on the next save.
+        """
+        if self.journal is None or self.journal.closed:
+            # Shutting down after the final save; the next start reloads the state on disk
+            return
+        record = {'op': op, 'guild': guild_id}
+        if keys:
+            record['digests'] = [key.hex() for key in keys]
+        self.journal.write(json_dumps(record) + b'\n')
+        self.journal.flush()
+
+    def replay_journal(self) -> int:
+        """Re-applies key mutations recorded since the last save. Every op is idempotent."""
+        replayed = 0
+        try:
+            with open('realms.journal', 'rb') as f:
+                for line in f:
+                    try:
+                        record = json_loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning("Skipping torn record in realms.journal.")
+                        continue
+                    cfg = self.config.get(record['guild'])
+                    if not cfg:
+                        continue
+                    # Records written before keys were salted carry the raw keys instead
+                    if 'digests' in record:
+                        normalized = map(bytes.fromhex, record['digests'])
+                    else:
+                        normalized = map(cfg.normalize_key, record.get('keys', ()))
+                    if record['op'] == 'add':
+                        cfg.insert_keys(normalized)
+                    elif record['op'] == 'remove':
+                        cfg.discard_keys(normalized)
+                    elif record['op'] == 'clear':
+                        cfg.clear_keys()
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        return replayed
+
+    def mark_dirty(self):
+        """Schedules a coalesced configuration save instead of writing immediately."""
+        self._save_event.set()
+
+    async def flush_config(self):
+        self._save_event.clear()
+        async with self.get_lock('global'):
+            try:
+                await self.save_config()
+            except Exception as e:
+                logging.error(f"Failed to save configuration: {e}", exc_info=True)
+
     async def periodic_save(self):
         await self.wait_until_ready()
         while not self.is_closed():
-            await asyncio.sleep(300)
-            logging.info("Initiating periodic configuration save...")
-            async with self.locks['global']:
-                await self.save_config()
-            logging.info("Periodic configuration save complete.")
+            try:
+                await asyncio.wait_for(self._save_event.wait(), timeout=300)
+                # Give bursts of mutations a moment to pile up so they share one write
+                await asyncio.sleep(1)
+            except asyncio.TimeoutError:
+                logging.info("Initiating periodic configuration save...")
+            await self.flush_config()
 
     async def load_config(self):
-        if not os.path.exists('bloom_filters'):
-            os.makedirs('bloom_filters')
-            logging.info("Created 'bloom_filters' directory.")
-
-        try:
-            with open('realms.json', 'r') as f:
-                realms = json.load(f)
-            for gid, data in realms.items():
-                guild_id = int(gid)
-                self.config[guild_id] = GuildConfig(data['role_id'], guild_id)
-                cfg = self.config[guild_id]
-                cfg.command = data.get('command', 'claim')
-                cfg.key_store = set(data.get('keys', []))
-                cfg.success_msgs = data.get('success_msgs', DRAMATIC_MESSAGES.copy())
-                cfg.custom_cooldown = data.get('custom_cooldown', 300)
-                cfg.announcement_channel_id = data.get('announcement_channel_id', None)
-                
-                saved_stats = data.get('stats', {})
-                if saved_stats:
-                    cfg.stats.update(saved_stats)
-                cfg.stats['total_keys'] = len(cfg.key_store)
-                
-                try:
-                    with open(cfg.filter_path, "rb") as bf:
-                        cfg.key_filter = ScalableBloomFilter.fromfile(bf)
-                    logging.info(f"Loaded bloom filter from {cfg.filter_path} for guild {guild_id}")
-                except FileNotFoundError:
-                    logging.warning(f"No bloom filter file found for guild {guild_id}. Rebuilding...")
-                    for key in cfg.key_store:
-                        cfg.key_filter.add(key)
-        except FileNotFoundError:
-            logging.warning("No existing configuration found. realms.json will be created.")
-            self.config = {}
-        except json.JSONDecodeError:
-            logging.error("Could not decode realms.json. File might be corrupt.")
-            self.config = {}
+        for directory in ('bloom_filters', 'realms'):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+                logging.info(f"Created '{directory}' directory.")
+
+        realms, self._legacy_snapshot = await asyncio.to_thread(read_snapshot)
+        if not realms:
+            logging.warning("No existing configuration found. Guild configs will be saved to 'realms/'.")
+        migrated = False
+        for gid, data in realms.items():
+            guild_id = int(gid)
+            self.config[guild_id] = GuildConfig(data['role_id'], guild_id)
+            cfg = self.config[guild_id]
+            cfg.command = data.get('command', 'claim')
+            cfg.key_store = data['keys']
+            cfg.salt = data['salt']
+            success_msgs = data.get('success_msgs')
+            if success_msgs and tuple(success_msgs) != DRAMATIC_MESSAGES:
+                cfg.success_msgs = success_msgs
+            cfg.custom_cooldown = data.get('custom_cooldown', 300)
+            cfg.announcement_channel_id = data.get('announcement_channel_id', None)
+            cfg.synced_command = data.get('synced_command')
+            
+            saved_stats = data.get('stats', {})
+            if saved_stats:
+                cfg.stats.update(saved_stats)
+            cfg.stats['total_keys'] = len(cfg.key_store)
+            # Guilds read from realms.json are rewritten to their own files on the first save
+            cfg.dirty = self._legacy_snapshot or 'migrated' in data
+            migrated = migrated or 'migrated' in data
+            
+            filter_loaded = False
+            try:
+                with open(cfg.filter_path, "rb") as bf:
+                    cfg.key_filter = ScalableBloomFilter.fromfile(bf)
+                # A filter file that is not the one saved with this config (an older copy, or
+                # one built from raw keys before salting) has a different count, so rebuild it
+                filter_loaded = 'migrated' not in data and data.get('filter_count') == len(cfg.key_filter)
+            except FileNotFoundError:
+                pass
+
+            if filter_loaded:
+                cfg.filter_dirty = False
+                logging.info(f"Loaded bloom filter from {cfg.filter_path} for guild {guild_id}")
+            else:
+                logging.warning(f"No usable bloom filter file found for guild {guild_id}. Rebuilding...")
+                # Hashing a large store is pure CPU work; keep it off the event loop
+                if len(cfg.key_store) < 1000:
+                    cfg.rebuild_filter()
+                else:
+                    await asyncio.to_thread(cfg.rebuild_filter)
+
+        replayed = self.replay_journal()
+        if replayed:
+            logging.info(f"Replayed {replayed} key changes from realms.journal.")
+            self.mark_dirty()
+        if self._legacy_snapshot:
+            self.mark_dirty()
+        if migrated:
+            # New journal records hold digests under the new salts, so those salts must be on
+            # disk before the journal reopens. Older records keep raw keys and replay either way.
+            logging.info("Storing salted key digests in place of raw keys.")
+            await self.save_config()
+            if any(cfg.filter_dirty for cfg in self.config.values()):
+                raise RuntimeError("Could not store the salted key digests; see the errors above.")
+        self.journal = open('realms.journal', 'ab')
 
     async def save_config(self):
-        data_to_save = {
-            str(gid): {
-                'role_id': cfg.role_id,
-                'command': cfg.command,
-                'keys': list(cfg.key_store),
-                'success_msgs': cfg.success_msgs,
-                'custom_cooldown': cfg.custom_cooldown,
-                'announcement_channel_id': cfg.announcement_channel_id,
-                'stats': cfg.stats
-            }
-            for gid, cfg in self.config.items()
-        }
-        with open('realms.json', 'w') as f:
-            json.dump(data_to_save, f, indent=4)
+        # Snapshot changed guilds on the loop, where nothing can change underneath us, then
+        # leave the file writes and fsync to a worker thread so heartbeats keep flowing.
+        filters = []
+        realms = []
+        for cfg in self.config.values():
+            if cfg.filter_dirty:
+                buffer = io.BytesIO()
+                cfg.key_filter.tofile(buffer)
+                filters.append((cfg, buffer.getvalue()))
+                cfg.filter_dirty = False
+                # The config records the filter's count, so it is rewritten alongside
+                cfg.dirty = True
+            if cfg.dirty:
+                realms.append((cfg, json_dumps(cfg.to_dict())))
+                cfg.dirty = False
+        removed = list(self.removed_paths)
+        self.removed_paths.clear()
+        # Every record is flushed as it is written, so the file size is exactly where records
+        # written during the snapshot will start. tell() on an append-mode handle can lag behind
+        # a truncate and would point past them.
+        journal_offset = os.fstat(self.journal.fileno()).st_size if self.journal else 0
 
-        for gid, cfg in self.config.items():
-            try:
-                with open(cfg.filter_path, "wb") as bf:
-                    cfg.key_filter.tofile(bf)
-            except Exception as e:
-                logging.error(f"Could not save bloom filter for guild {gid}: {e}")
+        try:
+            failed = await asyncio.to_thread(
+                write_snapshot,
+                [(cfg.config_path, cfg.filter_path, data) for cfg, data in realms],
+                [(cfg.filter_path, data) for cfg, data in filters],
+                removed,
+                self._legacy_snapshot
+            )
+        except Exception:
+            for cfg, _ in filters:
+                cfg.filter_dirty = True
+            for cfg, _ in realms:
+                cfg.dirty = True
+            self.removed_paths.update(removed)
+            raise
 
-    async def register_guild_commands(self, guild: discord.Guild, command_name: str):
+        if failed:
+            # Those guilds kept their old filter and config files; retry them on the next save,
+            # and keep the journal and realms.json since they still hold their latest keys
+            for cfg, _ in filters:
+                if cfg.filter_path in failed:
+                    cfg.filter_dirty = True
+                    cfg.dirty = True
+            self.mark_dirty()
+            return
+        self._legacy_snapshot = False
+
+        if self.journal:
+            self.compact_journal(journal_offset)
+
+    def compact_journal(self, offset: int):
+        """Drops the journal records before offset, which the last snapshot already contains."""
+        self.journal.flush()
+        with open('realms.journal', 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        if not tail:
+            self.journal.truncate(0)
+            self.journal.seek(0)
+            return
+        # Records arrived while the snapshot was being written; keep them
+        with open('realms.journal.tmp', 'wb') as f:
+            f.write(tail)
+        self.journal.close()
+        os.replace('realms.journal.tmp', 'realms.journal')
+        self.journal = open('realms.journal', 'ab')
+
+    async def sync_guild_commands(self, guilds):
+        """
+        Syncs several guild command trees concurrently, capped to stay clear of rate limits.
+        Returns how many syncs failed.
+        """
+        semaphore = asyncio.Semaphore(10)
+
+        async def sync_one(guild):
+            async with semaphore:
+                await self.tree.sync(guild=guild)
+            self.mark_synced(guild.id)
+
+        results = await asyncio.gather(*(sync_one(guild) for guild in guilds), return_exceptions=True)
+        failed = 0
+        for guild, result in zip(guilds, results):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to sync commands for guild {guild.id}: {result}")
+                failed += 1
+        return failed
+
+    async def register_guild_commands(self, guild: discord.Guild, command_name: str, sync: bool = True):
         """
         Registers or updates the dynamic claim command for a single guild.
         This function ensures one cog per guild for its dynamic command.
+        Pass sync=False when the caller will sync the guild's tree itself.
         """
         cog_name = f"ClaimCog_{guild.id}"
         existing_cog = self.get_cog(cog_name)
@@ -711,9 +1134,20 @@ class RealmKeeper(commands.Bot):
         await self.add_cog(claim_cog, guilds=[guild])
         logging.info(f"Registered command `/{command_name}` for guild {guild.name} ({guild.id})")
         
-        await self.tree.sync(guild=guild)
-        logging.info(f"Synced commands for guild {guild.id} after command update.")
-
+        cfg = self.config.get(guild.id)
+        # Re-running /setup with the same command name leaves Discord's copy unchanged
+        if sync and not (cfg and cfg.synced_command == command_name):
+            await self.tree.sync(guild=guild)
+            self.mark_synced(guild.id)
+            logging.info(f"Synced commands for guild {guild.id} after command update.")
+
+    def mark_synced(self, guild_id: int):
+        """Records that Discord now has the guild's current claim command."""
+        cfg = self.config.get(guild_id)
+        if cfg and cfg.synced_command != cfg.command:
+            cfg.synced_command = cfg.command
+            cfg.dirty = True
+            self.mark_dirty()
 
     async def process_claim(self, interaction: discord.Interaction, key: str):
         await interaction.response.defer(ephemeral=True)
@@ -731,7 +1165,9 @@ class RealmKeeper(commands.Bot):
             await interaction.followup.send("⚠️ The destined role has vanished from this realm!", ephemeral=True)
             return
 
-        if role in interaction.user.roles:
+        # Member.get_role checks the member's role ids directly; Member.roles would
+        # resolve and sort every role the member has on each claim
+        if interaction.user.get_role(role.id):
             await interaction.followup.send("✨ You have already been blessed with this power!", ephemeral=True)
             return
 
@@ -739,50 +1175,67 @@ class RealmKeeper(commands.Bot):
             await interaction.followup.send("⚠️ My role must be higher than the role I'm trying to grant!", ephemeral=True)
             return
 
-        try:
-            key_normalized = str(uuid.UUID(key.strip())).lower()
-        except ValueError:
+        key_bytes = cfg.normalize_key(key.strip())
+        if key_bytes is None:
             cfg.stats['failed_claims'] += 1
+            cfg.dirty = True
             await interaction.followup.send("❌ Invalid key format! Keys must be in UUID format.", ephemeral=True)
             return
 
-        async with self.locks[guild_id]:
-            if cfg.verify_key(key_normalized):
-                cfg.remove_key(key_normalized)
-                
-                try:
-                    await interaction.user.add_roles(role, reason="Key claim via Realm Keeper")
-                    
-                    cfg.stats['successful_claims'] += 1
-                    cfg.stats['last_claim_time'] = int(time.time())
-                    
-                    success_msg = random.choice(cfg.success_msgs).format(user=interaction.user.mention, role=role.mention)
-                    
-                    announcement_channel = None
-                    if cfg.announcement_channel_id:
-                        announcement_channel = interaction.guild.get_channel(cfg.announcement_channel_id)
-
-                    if announcement_channel and announcement_channel.permissions_for(interaction.guild.me).send_messages:
-                        await announcement_channel.send(success_msg)
-                        await interaction.followup.send(f"✅ Success! You have been granted the {role.mention} role. An announcement was made in {announcement_channel.mention}.", ephemeral=True)
-                    else:
-                        await interaction.followup.send(success_msg, ephemeral=False)
-                        if cfg.announcement_channel_id and not announcement_channel:
-                            logging.warning(f"Could not find announcement channel {cfg.announcement_channel_id} in guild {guild_id}.")
-                        elif announcement_channel:
-                             logging.warning(f"Missing 'Send Messages' permission in announcement channel {announcement_channel.name} ({cfg.announcement_channel_id}) in guild {guild_id}.")
-
-                except (discord.Forbidden, discord.HTTPException) as e:
-                    logging.error(f"Failed to grant role to {interaction.user}. Restoring key. Error: {e}")
-                    cfg.add_key(key_normalized)
-                    await interaction.followup.send("🔒 The mystical barriers prevent me from bestowing this power! Your key has not been consumed.", ephemeral=True)
-                except Exception as e:
-                    logging.error(f"An unexpected error occurred during role grant. Restoring key. Error: {e}", exc_info=True)
-                    cfg.add_key(key_normalized)
-                    await interaction.followup.send("💔 The ritual of bestowal has failed unexpectedly. Your key has not been consumed.", ephemeral=True)
+        # Pop the key before granting the role. The check-and-remove is synchronous, so two
+        # claims racing on the same key can never both win, and no lock has to be held
+        # across the Discord round trips below.
+        if not cfg.consume_key(key_bytes):
+            cfg.stats['failed_claims'] += 1
+            cfg.dirty = True
+            await interaction.followup.send("🌑 This key holds no power in these lands...", ephemeral=True)
+            return
+        self.journal_keys('remove', guild_id, [key_bytes])
+
+        try:
+            await interaction.user.add_roles(role, reason="Key claim via Realm Keeper")
+        except (discord.Forbidden, discord.HTTPException) as e:
+            logging.error(f"Failed to grant role to {interaction.user}. Restoring key. Error: {e}")
+            cfg.restore_key(key_bytes)
+            self.journal_keys('add', guild_id, [key_bytes])
+            await interaction.followup.send("🔒 The mystical barriers prevent me from bestowing this power! Your key has not been consumed.", ephemeral=True)
+            return
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during role grant. Restoring key. Error: {e}", exc_info=True)
+            cfg.restore_key(key_bytes)
+            self.journal_keys('add', guild_id, [key_bytes])
+            await interaction.followup.send("💔 The ritual of bestowal has failed unexpectedly. Your key has not been consumed.", ephemeral=True)
+            return
+
+        cfg.stats['successful_claims'] += 1
+        cfg.stats['last_claim_time'] = int(time.time())
+        
+        success_msg = random.choice(cfg.success_msgs).format(user=interaction.user.mention, role=role.mention)
+        
+        announcement_channel = None
+        if cfg.announcement_channel_id:
+            announcement_channel = interaction.guild.get_channel(cfg.announcement_channel_id)
+
+        # The role is granted at this point, so a failed announcement must not restore the key
+        try:
+            if announcement_channel and announcement_channel.permissions_for(interaction.guild.me).send_messages:
+                await announcement_channel.send(success_msg)
+                await interaction.followup.send(f"✅ Success! You have been granted the {role.mention} role. An announcement was made in {announcement_channel.mention}.", ephemeral=True)
             else:
-                cfg.stats['failed_claims'] += 1
-                await interaction.followup.send("🌑 This key holds no power in these lands...", ephemeral=True)
+                await interaction.followup.send(success_msg, ephemeral=False)
+                if cfg.announcement_channel_id and not announcement_channel:
+                    logging.warning(f"Could not find announcement channel {cfg.announcement_channel_id} in guild {guild_id}.")
+                elif announcement_channel:
+                     logging.warning(f"Missing 'Send Messages' permission in announcement channel {announcement_channel.name} ({cfg.announcement_channel_id}) in guild {guild_id}.")
+        except discord.HTTPException as e:
+            logging.error(f"Granted role to {interaction.user} but failed to send the success message. Error: {e}")
+
+async def main(token: str):
+    # Python 3.12+: start new tasks inline so handlers that never block skip a loop iteration
+    if hasattr(asyncio, 'eager_task_factory'):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    async with RealmKeeper() as bot:
+        await bot.start(token)
 
 if __name__ == "__main__":
     print("--- Realm Keeper script starting ---")
@@ -792,6 +1245,11 @@ if __name__ == "__main__":
     if not TOKEN:
         raise ValueError("Missing DISCORD_TOKEN in .env file or environment variables")
     
-    bot = RealmKeeper()
     print("--- Token loaded, attempting to run bot ---")
-    bot.run(TOKEN)
+    try:
+        if uvloop:
+            uvloop.run(main(TOKEN))
+        else:
+            asyncio.run(main(TOKEN))
+    except KeyboardInterrupt:
+        pass